@@ -24,7 +24,11 @@ setup(
     long_description=long_description(),
     long_description_content_type="text/markdown",
     install_requires=load_requirements("requirements.txt"),
-    extras_require={"signing": ["authsign>=0.3.1", "requests"]},
+    extras_require={
+        "signing": ["authsign>=0.3.1", "requests"],
+        "resiliparse": ["resiliparse>=0.14.0"],
+        "orjson": ["orjson>=3.6.0"],
+    },
     zip_safe=True,
     setup_requires=["pytest-runner"],
     entry_points="""
@@ -1,7 +1,16 @@
 import unittest
 import tempfile
 import os
-from wacz.main import main, now
+import gzip
+import json
+import hashlib
+import shutil
+from io import BytesIO
+from unittest.mock import patch
+from cdxj_indexer.main import write_cdx_index
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+from wacz.main import main, now, create_wacz
 from wacz.util import check_http_and_https
 
 import zipfile
@@ -316,3 +325,308 @@ class TestWaczIndexing(unittest.TestCase):
                         "pages/pages.jsonl",
                     ],
                 )
+
+    def test_warc_lz4_not_supported(self):
+        """LZ4 compressed WARCs should be rejected with a ValueError"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lz4_warc = os.path.join(tmpdir, "example.warc.lz4")
+            with open(lz4_warc, "wb") as fh:
+                fh.write(b"\x04\x22\x4d\x18" + b"\x00" * 16)
+
+            with self.assertRaises(ValueError):
+                main(
+                    [
+                        "create",
+                        "-f",
+                        lz4_warc,
+                        "-o",
+                        os.path.join(tmpdir, "example-lz4.wacz"),
+                    ]
+                )
+
+    def test_warc_with_duplicate_names(self):
+        """Entries with the same name should each be listed with their own hash"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            warcs = []
+            for dirname, fixture in (
+                ("a", "example-collection.warc"),
+                ("b", "example-iana.warc"),
+            ):
+                os.makedirs(os.path.join(tmpdir, dirname))
+                warc = os.path.join(tmpdir, dirname, "example.warc")
+                shutil.copyfile(os.path.join(TEST_DIR, fixture), warc)
+                warcs.append(warc)
+
+            self.assertEqual(
+                main(["create", "-o", os.path.join(tmpdir, "example.wacz")] + warcs),
+                0,
+            )
+
+            with zipfile.ZipFile(os.path.join(tmpdir, "example.wacz")) as zf:
+                datapackage = json.loads(zf.read("datapackage.json"))
+
+            hashes = [
+                resource["hash"]
+                for resource in datapackage["resources"]
+                if resource["path"] == "archive/example.warc"
+            ]
+            expected = []
+            for warc in warcs:
+                with open(warc, "rb") as fh:
+                    expected.append("sha256:" + hashlib.sha256(fh.read()).hexdigest())
+
+            self.assertEqual(hashes, expected)
+
+    def test_warc_without_hash_type(self):
+        """create_wacz should default to sha256 if called without a hash type"""
+
+        def create_wacz_without_hash_type(res):
+            res.hash_type = None
+            return create_wacz(res)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with patch("wacz.main.create_wacz", create_wacz_without_hash_type):
+                self.assertEqual(
+                    main(
+                        [
+                            "create",
+                            "-f",
+                            os.path.join(TEST_DIR, "example-collection.warc"),
+                            "-o",
+                            os.path.join(tmpdir, "example-collection.wacz"),
+                        ]
+                    ),
+                    0,
+                )
+
+            self.assertEqual(
+                main(
+                    ["validate", "-f", os.path.join(tmpdir, "example-collection.wacz")]
+                ),
+                0,
+            )
+
+            with zipfile.ZipFile(os.path.join(tmpdir, "example-collection.wacz")) as zf:
+                datapackage = json.loads(zf.read("datapackage.json"))
+
+            for resource in datapackage["resources"]:
+                self.assertTrue(resource["hash"].startswith("sha256:"))
+
+    def test_warc_with_cdxj_dir(self):
+        """Passing existing CDXJ with --cdxj should produce the same index as indexing the WARC"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            warc = os.path.join(TEST_DIR, "example-collection.warc")
+            cdxj_dir = os.path.join(tmpdir, "cdxj")
+            os.makedirs(cdxj_dir)
+
+            write_cdx_index(
+                os.path.join(cdxj_dir, "index.cdxj"),
+                [warc],
+                {
+                    "sort": True,
+                    "post_append": True,
+                    "digest_records": True,
+                    # default records, including warcinfo which is not indexed
+                    "fields": "referrer,req.http:cookie",
+                },
+            )
+
+            for output, extra_args in (
+                ("indexed.wacz", []),
+                ("merged.wacz", ["--cdxj", cdxj_dir]),
+            ):
+                self.assertEqual(
+                    main(
+                        [
+                            "create",
+                            "-f",
+                            warc,
+                            "-o",
+                            os.path.join(tmpdir, output),
+                            "--detect-pages",
+                        ]
+                        + extra_args
+                    ),
+                    0,
+                )
+
+            indexes = []
+            page_urls = []
+            for output in ("indexed.wacz", "merged.wacz"):
+                self.assertEqual(
+                    main(["validate", "-f", os.path.join(tmpdir, output)]), 0
+                )
+
+                with zipfile.ZipFile(os.path.join(tmpdir, output)) as zf:
+                    with zf.open("indexes/index.cdx.gz") as fh:
+                        indexes.append(gzip.decompress(fh.read()))
+
+                    with zf.open("pages/pages.jsonl") as fh:
+                        page_urls.append(
+                            sorted(json.loads(line).get("url", "") for line in fh)
+                        )
+
+            self.assertEqual(indexes[0], indexes[1])
+            self.assertEqual(page_urls[0], page_urls[1])
+
+    def test_warc_with_cdxj_dir_revisit(self):
+        """Revisits of HTML captures should be detected as pages with --cdxj too"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            warc = os.path.join(tmpdir, "example-revisit.warc")
+            with open(warc, "wb") as fh:
+                writer = WARCWriter(fh, gzip=False)
+                for url, referrer, date in (
+                    ("http://www.example.com/", None, "2020-01-01T00:00:00Z"),
+                    ("http://www.example.com/", None, "2020-01-02T00:00:00Z"),
+                    ("http://www.example.com/a.js", "http://www.example.com/", None),
+                ):
+                    headers = [("Referer", referrer)] if referrer else []
+                    request = writer.create_warc_record(
+                        url,
+                        "request",
+                        http_headers=StatusAndHeaders(
+                            "GET / HTTP/1.1", headers, is_http_request=True
+                        ),
+                    )
+                    http_headers = StatusAndHeaders(
+                        "200 OK", [("Content-Type", "text/html")], protocol="HTTP/1.1"
+                    )
+                    response = writer.create_warc_record(
+                        url,
+                        "response",
+                        payload=BytesIO(b"<html><body>Example</body></html>"),
+                        http_headers=http_headers,
+                        warc_headers_dict={"WARC-Date": date} if date else None,
+                    )
+                    # write later captures of the same payload as revisits
+                    if date and date.startswith("2020-01-02"):
+                        response = writer.create_revisit_record(
+                            url,
+                            response.rec_headers.get("WARC-Payload-Digest"),
+                            "http://www.example.com/",
+                            "2020-01-01T00:00:00Z",
+                            http_headers=http_headers,
+                            warc_headers_dict={"WARC-Date": date},
+                        )
+                    writer.write_request_response_pair(request, response)
+
+            cdxj_dir = os.path.join(tmpdir, "cdxj")
+            os.makedirs(cdxj_dir)
+
+            write_cdx_index(
+                os.path.join(cdxj_dir, "index.cdxj"),
+                [warc],
+                {
+                    "sort": True,
+                    "post_append": True,
+                    "digest_records": True,
+                    "fields": "referrer,req.http:cookie",
+                    "records": "response,revisit,resource,metadata",
+                },
+            )
+
+            pages = []
+            for output, extra_args in (
+                ("indexed.wacz", []),
+                ("merged.wacz", ["--cdxj", cdxj_dir]),
+            ):
+                self.assertEqual(
+                    main(
+                        [
+                            "create",
+                            "-f",
+                            warc,
+                            "-o",
+                            os.path.join(tmpdir, output),
+                            "--detect-pages",
+                        ]
+                        + extra_args
+                    ),
+                    0,
+                )
+
+                with zipfile.ZipFile(os.path.join(tmpdir, output)) as zf:
+                    with zf.open("pages/pages.jsonl") as fh:
+                        pages.append(
+                            sorted(
+                                (page["ts"], page["url"])
+                                for page in map(json.loads, fh)
+                                if "url" in page
+                            )
+                        )
+
+            self.assertEqual(
+                pages[0],
+                [
+                    ("2020-01-01T00:00:00Z", "http://www.example.com/"),
+                    ("2020-01-02T00:00:00Z", "http://www.example.com/"),
+                ],
+            )
+            self.assertEqual(pages[0], pages[1])
+
+    def test_cdxj_dir_with_other_warc_not_allowed(self):
+        """CDXJ lines must refer to the WARCs passed to create"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cdxj_dir = os.path.join(tmpdir, "cdxj")
+            os.makedirs(cdxj_dir)
+
+            write_cdx_index(
+                os.path.join(cdxj_dir, "index.cdxj"),
+                [os.path.join(TEST_DIR, "example-collection.warc")],
+                {"sort": True, "post_append": True},
+            )
+
+            with self.assertRaises(ValueError):
+                main(
+                    [
+                        "create",
+                        "-f",
+                        os.path.join(TEST_DIR, "example-warcinfo-metadata.warc"),
+                        "-o",
+                        os.path.join(tmpdir, "example-warcinfo-metadata.wacz"),
+                        "--cdxj",
+                        cdxj_dir,
+                    ]
+                )
+
+    def test_cdxj_dir_missing_warc_not_allowed(self):
+        """All WARCs passed to create must have CDXJ lines"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cdxj_dir = os.path.join(tmpdir, "cdxj")
+            os.makedirs(cdxj_dir)
+
+            write_cdx_index(
+                os.path.join(cdxj_dir, "example-iana.warc.cdxj"),
+                [os.path.join(TEST_DIR, "example-iana.warc")],
+                {"sort": True, "post_append": True},
+            )
+
+            with self.assertRaises(ValueError):
+                main(
+                    [
+                        "create",
+                        os.path.join(TEST_DIR, "example-resource.warc.gz"),
+                        os.path.join(TEST_DIR, "example-iana.warc"),
+                        "-o",
+                        os.path.join(tmpdir, "example-iana.wacz"),
+                        "--cdxj",
+                        cdxj_dir,
+                    ]
+                )
+
+    def test_cdxj_dir_with_text_not_allowed(self):
+        """--cdxj can not be combined with --text as WARC records are not read"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(SystemExit):
+                main(
+                    [
+                        "create",
+                        "-f",
+                        os.path.join(TEST_DIR, "example-collection.warc"),
+                        "-o",
+                        os.path.join(tmpdir, "example-collection.wacz"),
+                        "--cdxj",
+                        tmpdir,
+                        "--text",
+                    ]
+                )
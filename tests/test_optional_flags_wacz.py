@@ -180,6 +180,63 @@ class TestWaczFormat(unittest.TestCase):
                     self.assertTrue(obj["url"].encode() in cdx_content)
                     self.assertTrue("text" in obj.keys())
 
+    def test_warc_with_page_compression_stored_flag(self):
+        """When passing --page-compression stored, pages.jsonl and index.idx should be stored uncompressed"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            wacz_file = os.path.join(tmpdir, "example-collection-stored.wacz")
+            self.assertEqual(
+                main(
+                    [
+                        "create",
+                        "-f",
+                        os.path.join(TEST_DIR, "example-collection.warc"),
+                        "-o",
+                        wacz_file,
+                        "--detect-pages",
+                        "--page-compression",
+                        "stored",
+                    ]
+                ),
+                0,
+            )
+            with zipfile.ZipFile(wacz_file, "r") as zip_ref:
+                for filename in ("pages/pages.jsonl", "indexes/index.idx"):
+                    self.assertEqual(
+                        zip_ref.getinfo(filename).compress_type, zipfile.ZIP_STORED
+                    )
+
+            self.assertEqual(main(["validate", "-f", wacz_file]), 0)
+
+    def test_warc_with_text_extractor_flag(self):
+        """When passing the resiliparse text extractor, pages should include text (falls back to boilerpy3 if not installed)"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.assertEqual(
+                main(
+                    [
+                        "create",
+                        "-f",
+                        os.path.join(TEST_DIR, "example-collection.warc"),
+                        "-o",
+                        os.path.join(tmpdir, "example-collection-text.wacz"),
+                        "-t",
+                        "-d",
+                        "--text-extractor",
+                        "resiliparse",
+                    ]
+                ),
+                0,
+            )
+            with zipfile.ZipFile(
+                os.path.join(tmpdir, "example-collection-text.wacz"), "r"
+            ) as zip_ref:
+                with zip_ref.open("pages/pages.jsonl") as fh:
+                    pages = [json.loads(line) for line in fh.readlines()[1:]]
+
+            self.assertTrue(len(pages) > 0)
+            for page in pages:
+                self.assertTrue("title" in page.keys())
+                self.assertTrue("text" in page.keys())
+
     def test_warc_with_both_p_and_d_flag(self):
         """If a user passes both the --pages and --detect-pages flags we should return an error and a message about needing only one"""
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -369,6 +426,33 @@ class TestWaczFormat(unittest.TestCase):
             self.assertEqual(json_parse["mainPageURL"], "http://www.example.com/")
             assert "mainPageDate" not in json_parse.keys()
 
+    def test_warc_with_https_variant_of_url_flag(self):
+        """When passing the https variant of a captured http url, the main page should still be found"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.assertEqual(
+                main(
+                    [
+                        "create",
+                        "-f",
+                        os.path.join(TEST_DIR, "example-collection.warc"),
+                        "-o",
+                        os.path.join(tmpdir, "example-collection-https-url.wacz"),
+                        "--url",
+                        "https://www.example.com",
+                    ]
+                ),
+                0,
+            )
+            with zipfile.ZipFile(
+                os.path.join(tmpdir, "example-collection-https-url.wacz"), "r"
+            ) as zip_ref:
+                with zip_ref.open("pages/pages.jsonl") as fh:
+                    json_pages = [json.loads(jline) for jline in fh.read().splitlines()]
+                datapackage = json.loads(zip_ref.read("datapackage.json"))
+
+            self.assertEqual(json_pages[1]["url"], "http://www.example.com/")
+            self.assertEqual(datapackage["mainPageURL"], "http://www.example.com/")
+
     def test_warc_with_invalid_url_flag(self):
         """When passing an invalid url flag we should raise a ValueError"""
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -3,8 +3,11 @@ import tempfile
 import os
 import zipfile, json, gzip, hashlib
 from io import BytesIO
+from unittest.mock import patch
 
-from wacz.util import hash_stream, validateJSON
+from wacz.util import hash_stream, validateJSON, json_dumps_bytes, json_loads, orjson
+from wacz.util import HashingWriter, decode_html, brotli, init_brotli_decompressor
+from warcio.bufferedreaders import DecompressingBufferedReader
 
 TEST_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "fixtures")
 
@@ -22,6 +25,44 @@ class TestUtilFunctions(unittest.TestCase):
         self.assertEqual(bytes_, 4)
         self.assertEqual(hash_, test_hash)
 
+    def test_util_hashing_writer(self):
+        """HashingWriter should write through and match hash_stream of the written data"""
+        out = BytesIO()
+        writer = HashingWriter(out, "sha256")
+        writer.write(b"te")
+        writer.write(b"st")
+
+        self.assertEqual(out.getvalue(), b"test")
+        self.assertEqual(
+            (writer.size, writer.get_hash()),
+            hash_stream("sha256", BytesIO(b"test")),
+        )
+
+    def test_util_decode_html(self):
+        """decode_html should decode utf-8, BOMs and declared or unknown legacy charsets without raising"""
+        text = "<title>Caf\u00e9</title>"
+        self.assertEqual(decode_html(text.encode("utf-8")), text)
+        self.assertEqual(decode_html(b"\xef\xbb\xbf" + text.encode("utf-8")), text)
+        self.assertEqual(decode_html(b"\xff\xfe" + text.encode("utf-16-le")), text)
+        self.assertEqual(
+            decode_html(text.encode("cp1252"), 'text/html; charset="windows-1252"'),
+            text,
+        )
+        self.assertEqual(decode_html(text.encode("latin-1"), "text/html"), text)
+        self.assertEqual(
+            decode_html(text.encode("latin-1"), "text/html; charset=unknown"), text
+        )
+
+    @unittest.skipUnless(brotli, "brotli not installed")
+    def test_util_brotli_decompressor(self):
+        """'br' content should be decoded by warcio when the brotli package is installed"""
+        init_brotli_decompressor()
+        data = b"<html><body>brotli</body></html>" * 100
+        reader = DecompressingBufferedReader(
+            BytesIO(brotli.compress(data)), decomp_type="br"
+        )
+        self.assertEqual(reader.read(), data)
+
     def test_util_validate_json_succeed(self):
         """validate json method should succeed with valid json"""
         self.assertTrue(validateJSON('{"test": "test"}'))
@@ -30,6 +71,38 @@ class TestUtilFunctions(unittest.TestCase):
         """validate json method should fail with valid json"""
         self.assertFalse(validateJSON('test": "test"}'))
 
+    def test_util_json_dumps_bytes(self):
+        """json_dumps_bytes should return utf-8 JSON with or without orjson"""
+        data = {"url": "http://www.example.com/", "title": "Example \u00e9"}
+        self.assertEqual(json.loads(json_dumps_bytes(data)), data)
+
+        with patch("wacz.util.orjson", None):
+            self.assertEqual(json.loads(json_dumps_bytes(data)), data)
+
+        # orjson output is compact, json output has separator spaces
+        if orjson:
+            self.assertEqual(json_dumps_bytes({"pages": 1}), b'{"pages":1}')
+
+        with patch("wacz.util.orjson", None):
+            self.assertEqual(json_dumps_bytes({"pages": 1}), b'{"pages": 1}')
+
+        # lone surrogates are not supported by orjson, but are by json
+        data = {"url": "http://www.example.com/", "title": "Example \ud800"}
+        self.assertEqual(json.loads(json_dumps_bytes(data)), data)
+
+    def test_util_json_loads(self):
+        """json_loads should parse JSON with or without orjson"""
+        data = ' {"type": "recording", "pages": [{"url": "http://www.example.com/"}]}'
+        self.assertEqual(json_loads(data), json.loads(data))
+
+        # escaped lone surrogates are not supported by orjson, but are by json
+        data = '{"title": "Example \\ud800"}'
+        self.assertEqual(json_loads(data), {"title": "Example \ud800"})
+        self.assertEqual(json_loads(data.encode("utf-8")), json.loads(data))
+
+        with patch("wacz.util.orjson", None):
+            self.assertEqual(json_loads(data), json.loads(data))
+
 
 if __name__ == "__main__":
     unittest.main()
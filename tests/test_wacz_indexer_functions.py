@@ -2,11 +2,37 @@ import unittest
 import tempfile
 import os
 import zipfile, json, gzip
+from io import BytesIO
+from warcio.archiveiterator import ArchiveIterator
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import BufferWARCWriter
 from wacz.main import main, now
-from wacz.waczindexer import WACZIndexer
+from wacz.waczindexer import WACZIndexer, HTMLTree
 
 PAGE_INDEX = "pages/pages.jsonl"
 
+HTML_PAGE = (
+    b"<html><head><title>Example Domain</title></head><body><h1>Example Domain</h1>"
+    + b"<p>This domain is for use in illustrative examples in documents. You may use "
+    + b"this domain in literature without prior coordination or asking for permission.</p>"
+    + b"</body></html>"
+)
+
+
+def build_warc(responses):
+    """Builds an in-memory WARC with HTML responses for each (url, status) pair"""
+    writer = BufferWARCWriter()
+    for url, status in responses:
+        http_headers = StatusAndHeaders(
+            status, [("Content-Type", "text/html")], protocol="HTTP/1.1"
+        )
+        record = writer.create_warc_record(
+            url, "response", payload=BytesIO(HTML_PAGE), http_headers=http_headers
+        )
+        writer.write_record(record)
+
+    return BytesIO(writer.get_contents())
+
 
 def match_detected_pages(self, detected_pages, passed_pages_url, passed_pages_ts):
     for page in detected_pages:
@@ -78,6 +104,47 @@ class TestWaczIndexerFunctions(unittest.TestCase):
             },
         )
 
+    def test_norm_url(self):
+        """Urls differing only by scheme, host case, fragment or empty path should match"""
+        norm_url = WACZIndexer._norm_url
+        self.assertEqual(
+            norm_url("https://WWW.Example.com/path?a=b#frag"),
+            norm_url("http://www.example.com/path?a=b"),
+        )
+        self.assertEqual(
+            norm_url("https://www.example.com"), norm_url("http://www.example.com/")
+        )
+        self.assertNotEqual(
+            norm_url("http://www.example.com/Path"),
+            norm_url("http://www.example.com/path"),
+        )
+
+    def test_text_not_extracted_for_error_pages(self):
+        """Text should only be extracted from pages with a 2xx status"""
+        warc = build_warc(
+            [
+                ("http://www.example.com/", "200 OK"),
+                ("http://www.example.com/missing", "404 Not Found"),
+            ]
+        )
+        indexer = WACZIndexer(None, [], detect_pages=True, extract_text=True)
+        for record in ArchiveIterator(warc):
+            indexer.check_pages_and_text(record)
+
+        pages = {page["url"]: page for page in indexer.pages.values()}
+        self.assertTrue("text" in pages["http://www.example.com/"])
+        self.assertFalse("text" in pages["http://www.example.com/missing"])
+
+    @unittest.skipUnless(HTMLTree, "resiliparse not installed")
+    def test_extract_title_and_text_resiliparse(self):
+        """The resiliparse extractor should return the page title and main text"""
+        indexer = WACZIndexer(None, [], text_extractor="resiliparse")
+        self.assertEqual(indexer.text_extractor, "resiliparse")
+
+        title, text = indexer.extract_title_and_text(HTML_PAGE.decode("utf-8"))
+        self.assertEqual(title, "Example Domain")
+        self.assertTrue("illustrative examples" in text)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -3,6 +3,7 @@ from io import BytesIO, StringIO, TextIOWrapper
 import os, json, datetime, shutil, zipfile, sys, gzip, pkg_resources
 from wacz.waczindexer import WACZIndexer
 from wacz.util import now, WACZ_VERSION, construct_passed_pages_dict
+from wacz.util import set_page_compression, PAGE_COMPRESSION_TYPES, HashingWriter
 from wacz.validate import Validation, OUTDATED_WACZ
 from wacz.util import validateJSON, get_py_wacz_version
 from warcio.timeutils import iso_date_to_timestamp
@@ -45,6 +46,13 @@ def main(args=None):
         action="store_true",
     )
 
+    create.add_argument(
+        "--text-extractor",
+        choices=["boilerpy3", "resiliparse"],
+        default="boilerpy3",
+        help="Library used to extract page text with --text. resiliparse is faster but must be installed separately",
+    )
+
     create.add_argument(
         "-p",
         "--pages",
@@ -59,9 +67,17 @@ def main(args=None):
         action="store_true",
     )
 
+    create.add_argument(
+        "--page-compression",
+        choices=PAGE_COMPRESSION_TYPES,
+        default="deflate",
+        help="Compression used for page lists and index.idx in the WACZ. 'stored' writes them uncompressed",
+    )
+
     create.add_argument(
         "--hash-type",
         choices=["sha256", "md5"],
+        default="sha256",
         help="Allows the user to specify the hash type used. Currently we allow sha256 and md5",
     )
 
@@ -72,6 +88,12 @@ def main(args=None):
         action="store",
     )
 
+    create.add_argument(
+        "--cdxj",
+        help="Directory of existing, sorted CDXJ indexes for the passed WARCs. If set, the CDXJ files are merged into the WACZ index instead of indexing the WARCs",
+        action="store",
+    )
+
     create.add_argument("--split-seeds", action="store_true")
 
     create.add_argument("--ts")
@@ -113,6 +135,12 @@ def main(args=None):
             "--pages and --detect-pages can't be set at the same time they cancel each other out."
         )
 
+    if cmd.cmd == "create" and cmd.cdxj is not None:
+        if cmd.text or cmd.pages is not None or cmd.url is not None:
+            parser.error(
+                "--cdxj can't be combined with --text, --pages or --url, as WARC records are not read."
+            )
+
     value = cmd.func(cmd)
     return value
 
@@ -155,13 +183,16 @@ def validate_wacz(res):
 
 
 def create_wacz(res):
+    # default to sha256 if no hash type is set, eg. when called programmatically
+    hash_type = res.hash_type or "sha256"
+
     wacz = zipfile.ZipFile(res.output, "w")
 
     # write index
     data_file = zipfile.ZipInfo("indexes/index.cdx.gz", now())
 
     index_file = zipfile.ZipInfo("indexes/index.idx", now())
-    index_file.compress_type = zipfile.ZIP_DEFLATED
+    set_page_compression(index_file, res.page_compression)
 
     index_buff = BytesIO()
 
@@ -205,26 +236,33 @@ def create_wacz(res):
 
         extra_pages_file = zipfile.ZipInfo(EXTRA_PAGES_INDEX, now())
         with wacz.open(extra_pages_file, "w") as efh:
-            efh.write(b"\n".join(extra_page_data))
+            extra_pages_out = HashingWriter(efh, hash_type)
+            extra_pages_out.write(b"\n".join(extra_page_data))
 
     print("Reading and Indexing All WARCs")
     with wacz.open(data_file, "w") as data:
+        # hash index data as it is written, for datapackage.json
+        data_out = HashingWriter(data, hash_type)
+
         wacz_indexer = WACZIndexer(
             text_wrap,
             res.inputs,
             sort=True,
             post_append=True,
-            compress=data,
+            compress=data_out,
             lines=DEFAULT_NUM_LINES,
             digest_records=True,
             fields="referrer,req.http:cookie",
             data_out_name="index.cdx.gz",
-            hash_type=res.hash_type,
+            hash_type=hash_type,
             main_url=res.url,
             main_ts=res.ts,
             detect_pages=res.detect_pages,
             passed_pages_dict=passed_pages_dict,
             extract_text=res.text,
+            text_extractor=res.text_extractor,
+            page_compression=res.page_compression,
+            cdxj_dir=res.cdxj,
             signing_url=res.signing_url,
             signing_token=res.signing_token,
             split_seeds=res.split_seeds,
@@ -232,9 +270,14 @@ def create_wacz(res):
 
         wacz_indexer.process_all()
 
+    wacz_indexer.add_resource_hash(data_file, data_out)
+
+    if res.extra_pages:
+        wacz_indexer.add_resource_hash(extra_pages_file, extra_pages_out)
+
     index_buff.seek(0)
 
-    with wacz.open(index_file, "w") as index:
+    with wacz_indexer.open_resource(wacz, index_file) as index:
         shutil.copyfileobj(index_buff, index)
 
     # write archives
@@ -243,7 +286,7 @@ def create_wacz(res):
         archive_file = zipfile.ZipInfo.from_file(
             _input, "archive/" + os.path.basename(_input)
         )
-        with wacz.open(archive_file, "w") as out_fh:
+        with wacz_indexer.open_resource(wacz, archive_file) as out_fh:
             with open(_input, "rb") as in_fh:
                 shutil.copyfileobj(in_fh, out_fh)
                 path = "archive/" + os.path.basename(_input)
@@ -262,7 +305,7 @@ def create_wacz(res):
             log_wacz_file = zipfile.ZipInfo.from_file(
                 log_path, "logs/{}".format(log_file)
             )
-            with wacz.open(log_wacz_file, "w") as out_fh:
+            with wacz_indexer.open_resource(wacz, log_wacz_file) as out_fh:
                 with open(log_path, "rb") as in_fh:
                     shutil.copyfileobj(in_fh, out_fh)
                     path = "logs/{}".format(log_file)
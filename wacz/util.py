@@ -1,11 +1,56 @@
-import hashlib, datetime, json
+import hashlib, datetime, json, zipfile, zlib, codecs
 from warcio.timeutils import iso_date_to_timestamp
 import pkg_resources
 
+from warcio.bufferedreaders import BufferedReader
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 WACZ_VERSION = "1.1.1"
 
 
-BUFF_SIZE = 1024 * 64
+BUFF_SIZE = 1024 * 1024
+
+PAGE_COMPRESSION_TYPES = ("deflate", "stored")
+
+# byte order marks and their encodings, checked in order
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+
+
+class BrotliDecompressor:
+    """Adapts the brotli package's Decompressor to the decompressor
+    interface warcio expects (from brotlipy) for 'br' content
+    """
+
+    def __init__(self):
+        self.decompressor = brotli.Decompressor()
+        self.unused_data = None
+
+    def decompress(self, data):
+        return self.decompressor.process(data)
+
+    def flush(self):
+        return b""
+
+
+def init_brotli_decompressor():
+    """If the brotli package (rather than brotlipy) is installed, eg. as a
+    dependency of resiliparse, warcio fails decoding 'br' content, use an adapter
+    """
+    if brotli and not hasattr(brotli.Decompressor, "decompress"):
+        BufferedReader.DECOMPRESSORS["br"] = BrotliDecompressor
 
 
 def check_http_and_https(url, ts, pages_dict):
@@ -48,16 +93,38 @@ def hash_stream(hash_type, stream):
 
     size = 0
 
+    # read into a single reusable buffer to avoid allocating per chunk
+    buff = bytearray(BUFF_SIZE)
+    view = memoryview(buff)
+
     while True:
-        buff = stream.read(BUFF_SIZE)
-        size += len(buff)
-        hasher.update(buff)
-        if not buff:
+        num = stream.readinto(buff)
+        if not num:
             break
+        size += num
+        hasher.update(view[:num])
 
     return size, hash_type + ":" + hasher.hexdigest()
 
 
+class HashingWriter:
+    """Wraps a writable stream, hashing and counting all data written to it"""
+
+    def __init__(self, out, hash_type):
+        self.out = out
+        self.hash_type = hash_type
+        self.hasher = hashlib.new(hash_type)
+        self.size = 0
+
+    def write(self, buff):
+        self.hasher.update(buff)
+        self.size += len(buff)
+        return self.out.write(buff)
+
+    def get_hash(self):
+        return self.hash_type + ":" + self.hasher.hexdigest()
+
+
 def construct_passed_pages_dict(passed_pages_list):
     """Creates a dictionary of the passed pages with the url as the key or ts/url if ts is present and the title and text as the values if they have been passed"""
     passed_pages_dict = {}
@@ -87,6 +154,82 @@ def construct_passed_pages_dict(passed_pages_list):
     return passed_pages_dict
 
 
+def get_charset(content_type):
+    """Returns the charset parameter of a Content-Type header value, if any"""
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset":
+            return value.strip().strip("\"'")
+
+    return None
+
+
+def decode_html(content, content_type=None):
+    """Decodes HTML bytes to str, without raising on invalid encodings.
+    Checks for a BOM, then tries utf-8, then the charset from the
+    Content-Type, if any, and finally falls back to latin-1
+    :param content: HTML bytes
+    :param content_type: Content-Type header value
+    :rtype: str
+    """
+    for bom, encoding in BOM_ENCODINGS:
+        if content.startswith(bom):
+            return content[len(bom) :].decode(encoding, errors="replace")
+
+    try:
+        return content.decode("utf-8")
+    except UnicodeDecodeError:
+        pass
+
+    charset = get_charset(content_type) if content_type else None
+    if charset:
+        try:
+            return content.decode(charset, errors="replace")
+        except LookupError:
+            pass
+
+    return content.decode("latin-1", errors="replace")
+
+
+def json_dumps_bytes(data):
+    """Serializes data to utf-8 encoded JSON, using orjson if it is installed"""
+    if orjson:
+        try:
+            return orjson.dumps(data)
+        # orjson rejects some str json accepts, eg. lone surrogates
+        except TypeError:
+            pass
+
+    return json.dumps(data).encode("utf-8")
+
+
+def json_loads(data):
+    """Parses JSON from a str or bytes, using orjson if it is installed"""
+    if orjson:
+        try:
+            return orjson.loads(data)
+        # orjson rejects some JSON json accepts, eg. escaped lone surrogates
+        except orjson.JSONDecodeError:
+            pass
+
+    return json.loads(data)
+
+
+def set_page_compression(zip_info, compression="deflate"):
+    """Sets the compression of a page list or index zip entry
+    :param zip_info: ZipInfo of the entry
+    :param compression: 'deflate' (at fastest level) or 'stored' (uncompressed)
+    """
+    if compression == "stored":
+        zip_info.compress_type = zipfile.ZIP_STORED
+        return
+
+    zip_info.compress_type = zipfile.ZIP_DEFLATED
+    # these entries compress well, favor speed. ZipInfo has no public
+    # attribute for this, ZipFile.open() reads _compresslevel
+    zip_info._compresslevel = zlib.Z_BEST_SPEED
+
+
 def now():
     """Returns the current time"""
     return tuple(datetime.datetime.utcnow().timetuple()[:6])
@@ -1,23 +1,49 @@
 import json, shortuuid
 from urllib.parse import quote, urlsplit, urlunsplit
-import os, gzip, glob, zipfile, traceback
+import os, gzip, glob, zipfile, traceback, heapq
 from cdxj_indexer.main import CDXJIndexer
 from warcio.warcwriter import BufferWARCWriter
+from warcio.archiveiterator import ArchiveIterator
 from warcio.timeutils import iso_date_to_timestamp, timestamp_to_iso_date
 from boilerpy3 import extractors
+
+try:
+    from resiliparse.parse.html import HTMLTree
+    from resiliparse.extract.html2text import extract_plain_text
+except ImportError:
+    HTMLTree = None
 from wacz.util import (
     hash_stream,
     now,
     WACZ_VERSION,
     get_py_wacz_version,
     check_http_and_https,
+    json_dumps_bytes,
+    json_loads,
+    set_page_compression,
+    HashingWriter,
+    decode_html,
+    init_brotli_decompressor,
 )
 
 import datetime
 import hashlib
 import requests
+from contextlib import contextmanager
+
+HTML_MIME_TYPES = frozenset(("text/html", "application/xhtml", "application/xhtml+xml"))
+
+# Record types which may contain a page
+PAGE_RECORD_TYPES = frozenset(("response", "resource", "revisit"))
 
-HTML_MIME_TYPES = ("text/html", "application/xhtml", "application/xhtml+xml")
+# Magic bytes at the start of an LZ4 frame
+LZ4_FRAME_MAGIC = b"\x04\x22\x4d\x18"
+
+# Size of raw reads from WARC inputs, larger than the warcio default (16K)
+# to reduce the number of reads and decompressor calls per record
+READ_BLOCK_SIZE = 1024 * 64
+
+init_brotli_decompressor()
 
 # Add warcinfo as a default record for indexing to simplify filtering logic
 CDXJIndexer.DEFAULT_RECORDS.append("warcinfo")
@@ -63,6 +89,8 @@ class WACZIndexer(CDXJIndexer):
         except:
             pass
 
+        self._main_url_norm = self._norm_url(self.main_url) if self.main_url else None
+
         self.detect_pages = kwargs.get("detect_pages")
         self.detect_referrer_check = True
         self.extract_text = kwargs.get("extract_text")
@@ -72,29 +100,186 @@ class WACZIndexer(CDXJIndexer):
             )
         self.referrers = set()
 
+        self.text_extractor = kwargs.get("text_extractor") or "boilerpy3"
+        if self.text_extractor == "resiliparse" and not HTMLTree:
+            print(
+                "resiliparse package not found, using boilerpy3 for text extraction. Try installing with 'pip install wacz[resiliparse]'"
+            )
+            self.text_extractor = "boilerpy3"
+
+        self.page_compression = kwargs.get("page_compression") or "deflate"
+
+        # if set, merge existing CDXJ files from this dir instead of indexing WARCs
+        self.cdxj_dir = kwargs.get("cdxj_dir")
+        self._cdxj_merged = False
+
+        # WARC filenames referenced by the CDXJ and of the WARCs passed in
+        self._cdxj_filenames = set()
+        self._warc_filenames = set()
+
+        # payload digests of HTML captures and revisit pages awaiting them,
+        # as CDXJ lines for revisits don't include the original mime type
+        self._html_digests = set()
+        self._cdxj_revisits = []
+
+        # size and hash of zip entries by ZipInfo, recorded while they are written
+        # (keyed by ZipInfo rather than filename, as names may be repeated)
+        self._resource_hashes = {}
+
+        # boilerpy3 extractor, created on first use and reused for all pages
+        self._extractor = None
+
+    def _create_record_iter(self, input_):
+        # LZ4 compressed WARCs can not be indexed with offsets into the
+        # compressed file or replayed from a WACZ, fail early with a clear error
+        if hasattr(input_, "peek") and input_.peek(4)[:4] == LZ4_FRAME_MAGIC:
+            raise ValueError(
+                "LZ4 compressed WARCs are not supported, please use gzip or uncompressed WARCs"
+            )
+
+        return ArchiveIterator(
+            input_,
+            no_record_parse=not self.record_parse,
+            arc2warc=True,
+            verify_http=self.verify_http,
+            block_size=READ_BLOCK_SIZE,
+        )
+
+    def process_one(self, input_, output, filename):
+        if not self.cdxj_dir:
+            super().process_one(input_, output, filename)
+            return
+
+        # index lines for all WARCs come from the CDXJ files, write them once
+        if not self._cdxj_merged:
+            self.merge_cdxj(output)
+            self._cdxj_merged = True
+
+        self._warc_filenames.add(self._resolve_rel_path(filename))
+
+        # only read the warcinfo records at the start of the WARC for metadata
+        for record in self._create_record_iter(input_):
+            if record.rec_type != "warcinfo":
+                break
+
+            self.parse_warcinfo(record)
+
+    def merge_cdxj(self, output):
+        """Merge the sorted CDXJ files in cdxj_dir into the index output
+        :param output: index output to write lines to
+        """
+        paths = sorted(glob.glob(os.path.join(self.cdxj_dir, "*.cdxj")))
+        if not paths:
+            raise ValueError("No .cdxj files found in %s" % self.cdxj_dir)
+
+        cdxj_files = [open(path, "rt", encoding="utf-8") for path in paths]
+        try:
+            for line in heapq.merge(*cdxj_files):
+                # skip empty lines and meta lines, eg. '!meta'
+                if not line.strip() or line.startswith("!"):
+                    continue
+
+                if not line.endswith("\n"):
+                    line += "\n"
+
+                urlkey, ts, data = line.split(" ", 2)
+                index = json_loads(data)
+
+                self._cdxj_filenames.add(index.get("filename"))
+
+                # skip warcinfo records (without url), which are not indexed
+                # when indexing WARCs, eg. from CDXJ for all record types
+                if urlkey == "-":
+                    continue
+
+                if self.detect_pages:
+                    self.detect_index_page(ts, index)
+
+                output.write(line)
+        finally:
+            for cdxj_file in cdxj_files:
+                cdxj_file.close()
+
+        if self.detect_pages:
+            self.add_revisit_pages()
+
+    def detect_index_page(self, ts, index):
+        """Detect pages from an existing CDXJ line, as done for WARC records
+        :param ts: timestamp of the CDXJ line
+        :param index: parsed JSON of the CDXJ line
+        """
+        self.detect_page(ts, index)
+
+        url = index.get("url")
+        if not url or index.get("status", "200").startswith("3"):
+            return
+
+        mime = (index.get("mime") or "").lower()
+
+        # revisits are pages if the payload they refer to is HTML,
+        # which may only be known once all lines are read
+        if mime == "warc/revisit":
+            self._cdxj_revisits.append((ts, url, index.get("digest")))
+            return
+
+        if mime not in HTML_MIME_TYPES:
+            return
+
+        if index.get("digest"):
+            self._html_digests.add(index["digest"])
+
+        self.pages.setdefault(
+            ts + "/" + url, {"timestamp": ts, "url": url, "title": url}
+        )
+
+    def add_revisit_pages(self):
+        """Add pages for revisits of HTML captures found in the CDXJ"""
+        for ts, url, digest in self._cdxj_revisits:
+            if digest in self._html_digests:
+                self.pages.setdefault(
+                    ts + "/" + url, {"timestamp": ts, "url": url, "title": url}
+                )
+
+        self._cdxj_revisits = []
+
     def process_index_entry(self, it, record, *args):
+        # records have already been checked with filter_record() in process_one()
         type_ = record.rec_type
         if type_ == "warcinfo":
             self.parse_warcinfo(record)
+            return
 
-        elif self.filter_record(record):
-            if type_ in ("response", "resource", "revisit"):
-                self.check_pages_and_text(record)
+        if type_ in PAGE_RECORD_TYPES:
+            self.check_pages_and_text(record)
 
-            super().process_index_entry(it, record, *args)
+        super().process_index_entry(it, record, *args)
 
     def process_all(self):
         super().process_all()
 
+        # index lines must point to the WARCs added to the WACZ and all
+        # WARCs added must have index lines, otherwise they can't be replayed
+        unknown_filenames = self._cdxj_filenames - self._warc_filenames
+        if unknown_filenames:
+            raise ValueError(
+                "CDXJ refers to WARCs which were not passed in: %s"
+                % ", ".join(sorted(map(str, unknown_filenames)))
+            )
+
+        unindexed_filenames = self._warc_filenames - self._cdxj_filenames
+        if unindexed_filenames:
+            raise ValueError(
+                "CDXJ has no lines for WARCs which were passed in: %s"
+                % ", ".join(sorted(unindexed_filenames))
+            )
+
         if self.detect_pages:
             if self.detect_referrer_check:
-                to_delete = [
-                    id_
+                self.pages = {
+                    id_: value
                     for id_, value in self.pages.items()
-                    if value["url"] not in self.referrers
-                ]
-                for delete in to_delete:
-                    del self.pages[delete]
+                    if self._norm_url(value["url"]) in self.referrers
+                }
 
             if self.passed_pages_dict == {}:
                 print("Num Pages Detected: {0}".format(len(self.pages)))
@@ -125,7 +310,26 @@ class WACZIndexer(CDXJIndexer):
     def detect_page(self, ts, index):
         referrer = index.get("referrer")
         if referrer:
-            self.referrers.add(referrer)
+            self.referrers.add(self._norm_url(referrer))
+
+    @staticmethod
+    def _norm_url(url):
+        """Normalize url for comparison: http and https are treated as
+        equivalent, scheme and host are lowercased and fragment is removed
+        """
+        try:
+            scheme, netloc, path, query, _ = urlsplit(url)
+        except ValueError:
+            return url
+
+        scheme = scheme.lower()
+        if scheme == "https":
+            scheme = "http"
+
+        if netloc and not path:
+            path = "/"
+
+        return urlunsplit((scheme, netloc.lower(), path, query, ""))
 
     def _read_record(self, record):
         if hasattr(record, "buffered_stream"):
@@ -136,21 +340,18 @@ class WACZIndexer(CDXJIndexer):
         return content
 
     def parse_warcinfo(self, record):
-        """Parse WARC information.
+        """Parse WARC information, setting title, description and pages
+        from the json-metadata field, if any.
         :param record: WARC information
-        :returns: WARC information or None
-        :rtype: dict or None
         """
-        warcinfo = {}
         warcinfo_buff = self._read_record(record)
         warcinfo_buff = warcinfo_buff.decode("utf-8")
         metadata = None
+        # only the json-metadata field is used, other fields are not parsed
         for line in warcinfo_buff.rstrip().split("\n"):
-            parts = line.split(":", 1)
-            if parts[0] == "json-metadata":
-                metadata = json.loads(parts[1])
-            elif len(parts) == 2:
-                warcinfo[parts[0]] = parts[1].strip()
+            name, _, value = line.partition(":")
+            if name == "json-metadata":
+                metadata = json_loads(value)
 
         if not metadata or "type" not in metadata:
             return
@@ -165,9 +366,9 @@ class WACZIndexer(CDXJIndexer):
         # Don't add the record to the self.pages if were evaluating passed in pages
         elif metadata["type"] == "recording" and self.passed_pages_dict == {}:
             pages = metadata.get("pages", [])
-            for page in pages:
-                id_ = page["timestamp"] + "/" + page["url"]
-                self.pages[id_] = page
+            self.pages.update(
+                {page["timestamp"] + "/" + page["url"]: page for page in pages}
+            )
 
         self.detect_referrer_check = False
 
@@ -198,20 +399,21 @@ class WACZIndexer(CDXJIndexer):
         id_ = ts + "/" + url
         matched_id = ""
         # Check for both a matching url/ts and url entry
+        # (only if any passed pages remain unmatched)
+        if self.passed_pages_dict:
+            matched_id = check_http_and_https(url, ts, self.passed_pages_dict)
 
-        # if id_ in self.passed_pages_dict:
-        #    matched_id = id_
-
-        matched_id = check_http_and_https(url, ts, self.passed_pages_dict)
         # If we find a match build a record
         if matched_id:
             new_page = {"timestamp": ts, "url": url, "title": url}
-            input_page = self.passed_pages_dict[matched_id]
+
+            # Remove the entry from our pages_dict so we can't match it again
+            input_page = self.passed_pages_dict.pop(matched_id)
 
             # Add title and text if they've been provided
             if "title" in input_page:
                 new_page["title"] = input_page["title"]
-            if "text" in self.passed_pages_dict[matched_id]:
+            if "text" in input_page:
                 new_page["text"] = input_page["text"]
 
             if self.split_seeds and not input_page.get("seed"):
@@ -219,48 +421,37 @@ class WACZIndexer(CDXJIndexer):
             else:
                 self.pages[matched_id] = new_page
 
-            # Delete the entry from our pages_dict so we can't match it again
-            del self.passed_pages_dict[matched_id]
+        # compare normalized urls, so eg. http and https variants of main url match
+        is_main_url = self._main_url_norm is not None and (
+            url == self.main_url or self._norm_url(url) == self._main_url_norm
+        )
 
-        if (
-            self.main_url
-            and self.main_url == url
-            and self.main_ts
-            and self.main_ts == ts
-        ):
+        if is_main_url and self.main_ts and self.main_ts == ts:
             self.main_ts_flag = True
             self.main_url_flag = True
+            # use the captured url as the main page url, it may differ from the passed one
+            self.main_url = url
             print("Found Main Url: {0}".format(url))
             print("Found Main ts: {0}".format(ts))
             # If were not relying on passed in pages we want to add all records to the self.pages object
             if self.passed_pages_dict == {}:
-                self.main_page_entry = {
-                    "timestamp": ts,
-                    "url": url,
-                    "title": url,
-                    "seed": True,
-                }
-                self.main_page_id = id_
-                self.pages[id_] = self.main_page_entry
-        if self.main_url and self.main_url == url and self.main_ts == None:
+                self._set_main_page(id_, ts, url)
+        if is_main_url and self.main_ts == None:
             self.main_url_flag = True
+            self.main_url = url
             print("Found Main Url: {0}".format(url))
             if id_ not in self.pages:
-                self.main_page_entry = {
-                    "timestamp": ts,
-                    "url": url,
-                    "title": url,
-                    "seed": True,
-                }
-                self.main_page_id = id_
-                self.pages[id_] = self.main_page_entry
+                self._set_main_page(id_, ts, url)
 
         mime = self.get_record_mime_type(record)
 
         if mime not in HTML_MIME_TYPES:
             return
 
-        if record.http_headers and record.http_headers.get_statuscode().startswith("3"):
+        # status of records without HTTP headers (eg. resource) is treated as 200
+        status = record.http_headers.get_statuscode() if record.http_headers else "200"
+
+        if status[:1] == "3":
             return
 
         if id_ not in self.pages:
@@ -273,34 +464,57 @@ class WACZIndexer(CDXJIndexer):
         if not self.extract_text:
             return
 
+        # don't extract text from error pages, check before reading the body
+        if status[:1] != "2":
+            return
+
         content = self._read_record(record)
         if not content:
             return
 
         try:
-            extractor = extractors.ArticleExtractor(raise_on_failure=False)
-
-            content = content.decode("utf-8")
+            content = decode_html(content, self.get_record_content_type(record))
 
-            doc = extractor.get_doc(content)
+            title, text = self.extract_title_and_text(content)
 
             curr_page = self.pages[id_]
 
-            if doc.content:
-                self.pages[id_]["text"] = doc.content
+            if text:
+                self.pages[id_]["text"] = text
                 self.has_text = True
 
             # only set title if unset, or set to url (default)
             # avoid overriding user-specified title, if any
-            if doc.title and self.pages[id_].get("title", url) == url:
-                self.pages[id_]["title"] = doc.title
+            if title and self.pages[id_].get("title", url) == url:
+                self.pages[id_]["title"] = title
 
         except Exception as e:
             # skip text extraction in case of errors
             print("Skipping, Text Extraction Failed For: " + url)
             print(e)
 
-    def get_record_mime_type(self, record):
+    def extract_title_and_text(self, content):
+        """Extract the title and main text content from an HTML page
+        :param content: decoded HTML content
+        :returns: title and text, either may be empty
+        :rtype: tuple
+        """
+        if self.text_extractor == "resiliparse":
+            tree = HTMLTree.parse(content)
+            return tree.title, extract_plain_text(tree, main_content=True)
+
+        if self._extractor is None:
+            self._extractor = extractors.ArticleExtractor(raise_on_failure=False)
+
+        doc = self._extractor.get_doc(content)
+        return doc.title, doc.content
+
+    def _set_main_page(self, id_, ts, url):
+        self.main_page_entry = {"timestamp": ts, "url": url, "title": url, "seed": True}
+        self.main_page_id = id_
+        self.pages[id_] = self.main_page_entry
+
+    def get_record_content_type(self, record):
         if record.http_headers:
             # if the record has HTTP headers, use the Content-Type from those (eg. 'response' record)
             content_type = record.http_headers["Content-Type"]
@@ -308,16 +522,36 @@ class WACZIndexer(CDXJIndexer):
             # otherwise, use the Content-Type from WARC headers
             content_type = record.rec_headers["Content-Type"]
 
-        mime = content_type or ""
-        return mime.split(";")[0]
+        return content_type or ""
+
+    def get_record_mime_type(self, record):
+        mime = self.get_record_content_type(record)
+        return mime.partition(";")[0].strip().lower()
 
     def write_page_list(self, wacz, filename, page_iter):
         pages_file = zipfile.ZipInfo(filename, now())
-        pages_file.compress_type = zipfile.ZIP_DEFLATED
+        set_page_compression(pages_file, self.page_compression)
 
-        with wacz.open(pages_file, "w") as pg_fh:
+        with self.open_resource(wacz, pages_file) as pg_fh:
             for line in page_iter:
-                pg_fh.write(line.encode("utf-8"))
+                pg_fh.write(line)
+
+    @contextmanager
+    def open_resource(self, wacz, zip_info):
+        """Open a zip entry for writing, recording its size and hash
+        for datapackage.json so that it does not need to be read again
+        :param wacz: WACZ zip file
+        :param zip_info: ZipInfo of the entry
+        """
+        with wacz.open(zip_info, "w") as fh:
+            writer = HashingWriter(fh, self.hash_type)
+            yield writer
+
+        self.add_resource_hash(zip_info, writer)
+
+    def add_resource_hash(self, zip_info, writer):
+        """Record size and hash of a zip entry written through a HashingWriter"""
+        self._resource_hashes[zip_info] = writer.size, writer.get_hash()
 
     def serialize_json_pages(self, pages, id, title, desc=None, has_text=False):
         page_header = {"format": "json-pages-1.0", "id": id}
@@ -331,7 +565,7 @@ class WACZIndexer(CDXJIndexer):
         if has_text:
             page_header["hasText"] = True
 
-        yield json.dumps(page_header) + "\n"
+        yield json_dumps_bytes(page_header) + b"\n"
 
         for line in pages:
             ts = timestamp_to_iso_date(line["timestamp"])
@@ -347,7 +581,7 @@ class WACZIndexer(CDXJIndexer):
             if "text" in line:
                 data["text"] = line["text"]
 
-            yield json.dumps(data) + "\n"
+            yield json_dumps_bytes(data) + b"\n"
 
     def generate_datapackage(self, res, wacz):
         package_dict = {}
@@ -357,14 +591,18 @@ class WACZIndexer(CDXJIndexer):
         resources = []
 
         for zip_entry in wacz.infolist():
+            # only read back entries not hashed while writing
+            if zip_entry in self._resource_hashes:
+                size, hash_ = self._resource_hashes[zip_entry]
+            else:
+                with wacz.open(zip_entry, "r") as stream:
+                    size, hash_ = hash_stream(self.hash_type, stream)
+
             res_entry = {}
             res_entry["name"] = os.path.basename(zip_entry.filename).lower()
             res_entry["path"] = zip_entry.filename
-
-            with wacz.open(zip_entry, "r") as stream:
-                size, hash_ = hash_stream(self.hash_type, stream)
-                res_entry["hash"] = hash_
-                res_entry["bytes"] = size
+            res_entry["hash"] = hash_
+            res_entry["bytes"] = size
 
             resources.append(res_entry)
 